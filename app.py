@@ -1,12 +1,26 @@
+import atexit
+import itertools
 import json
 import os
 import logging
+import queue
+from logging.handlers import MemoryHandler
+import threading
+from collections import OrderedDict
+from functools import lru_cache, wraps
 
-from flask import Flask, render_template, request, redirect, url_for, flash
+try:
+    import orjson # Faster JSON parsing/serialization, falls back to the standard library
+except ImportError:
+    orjson = None
+
+from flask import Flask, render_template, request, redirect, url_for, flash, session
+from jinja2 import FileSystemBytecodeCache
 from opentelemetry import trace
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
 from opentelemetry.exporter.jaeger.thrift import JaegerExporter
 from opentelemetry.trace import SpanKind
@@ -14,28 +28,50 @@ from opentelemetry.trace import SpanKind
 # Flask App Initialization
 app = Flask(__name__)
 app.secret_key = 'secret' # Required for flashing messages
-COURSE_FILE = 'course_catalog.json' # JSON file to store course data
+app.config['TEMPLATES_AUTO_RELOAD'] = False # Templates aren't checked for changes on every render
+COURSE_FILE = 'course_catalog.jsonl' # JSON Lines file to store course data, one course per line
+COURSE_FIELDS = ('code', 'name', 'instructor', 'semester', 'schedule', 'classroom',
+                 'prerequisites', 'grading', 'description') # Fields stored for each course
+
+# Caching compiled templates on disk so restarts and other workers skip recompiling them
+# (Jinja's default directory is per-user, created with 0700 and ownership-checked)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(pattern='%s.cache')
 
 # Setting Flask logger level at INFO 
 app.logger.setLevel(logging.INFO)
 
-# Configure logging to export to a .json file
-log_handler = logging.FileHandler('app_logs.json')
+
+class JsonLineFormatter(logging.Formatter):
+    """Format each log record as one JSON object per line, escaping the message."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry)
+
+
+# Configure logging to export to a JSON Lines file
+log_handler = logging.FileHandler('app_logs.jsonl')
 log_handler.setLevel(logging.INFO)
-# Setting the log formatter to format the log messages as JSON
-log_formatter = logging.Formatter(
-    json.dumps({
-        "time": "%(asctime)s",
-        "level": "%(levelname)s",
-        "message": "%(message)s"
-    },indent=4)
-)
-log_handler.setFormatter(log_formatter)
-app.logger.addHandler(log_handler)
+# Setting the log formatter to format each log message as one JSON object per line
+log_handler.setFormatter(JsonLineFormatter())
+# Buffering records and writing them in batches, errors are still flushed immediately
+buffered_log_handler = MemoryHandler(capacity=512, flushLevel=logging.ERROR, target=log_handler)
+app.logger.addHandler(buffered_log_handler)
+atexit.register(buffered_log_handler.flush) # Flush buffered records on shutdown
 
 # OpenTelemetry Setup
 resource = Resource.create({"service.name": "course-catalog-service"})
-trace.set_tracer_provider(TracerProvider(resource=resource))
+# Sampling a fraction of root traces so most requests take the non-recording fast path
+TRACE_SAMPLE_RATIO = float(os.environ.get('TRACE_SAMPLE_RATIO', '0.01'))
+trace.set_tracer_provider(TracerProvider(resource=resource, sampler=ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO))))
 tracer = trace.get_tracer(__name__)
 jaeger_exporter = JaegerExporter(
     agent_host_name="localhost",
@@ -45,113 +81,238 @@ span_processor = BatchSpanProcessor(jaeger_exporter)
 trace.get_tracer_provider().add_span_processor(span_processor)
 FlaskInstrumentor().instrument_app(app) # Instrumenting the Flask app for tracing
 
-# Initialize catalog access count
-catalog_access_count = 0
+# Initialize catalog access counter (next() on itertools.count is atomic)
+catalog_access_counter = itertools.count(1)
+
+# Initialize error counter
+error_counter = itertools.count(1)
+
+# Initialize bounded LRU of logged IPs so memory doesn't grow with every new client
+MAX_LOGGED_IPS = 10000
+logged_ips = OrderedDict()
+_logged_ips_lock = threading.Lock()
 
-# Initialize error count
-error_count=0
+# In-memory cache of the parsed course catalog, refreshed when the file's mtime changes
+_courses_cache = None
+_courses_mtime = 0
+_courses_by_code = {} # Index of cached courses by course code
+_catalog_version = 0 # Bumped whenever the cached catalog changes
+_courses_lock = threading.Lock() # Flask's dev server is multi-threaded
 
-# Initialize set to track logged IPs
-logged_ips = set()
+# Pre-rendered catalog page and the catalog version it was rendered from
+_rendered_catalog = (None, -1)
+
+# Queue of (path, payload, course) writes consumed by a background writer thread
+_write_queue = queue.Queue()
+_pending_courses = [] # Courses added to the cache but not yet appended to the file
+_appends_in_flight = 0 # Appends currently writing to the file outside the cache lock
 
 # Utility Functions
-def load_courses():
-    """Load courses from the JSON file."""
-    if not os.path.exists(COURSE_FILE):
-        return []  # Return an empty list if the file doesn't exist
-    with open(COURSE_FILE, 'r') as file:
-        return json.load(file) # Load the courses from the file
-
-def save_courses(data):
-    """Save new course data to the JSON file."""
+def load_courses() -> list[dict]:
+    """Load courses from the JSON Lines file, reusing the cached copy if the file is unchanged."""
+    return load_catalog()[0]
+
+def load_catalog() -> tuple[list[dict], int]:
+    """Load courses like load_courses, along with the catalog version they belong to.
+
+    Both are read under the cache lock, so the version can key anything rendered from the courses.
+    """
+    global _courses_cache, _courses_mtime, _courses_by_code, _catalog_version
+    try:
+        mtime = os.stat(COURSE_FILE).st_mtime
+    except FileNotFoundError:
+        with _courses_lock:
+            if _courses_cache is None or _courses_mtime != 0:
+                # No file yet (or it was removed), so the catalog is just the courses still queued for it
+                _courses_cache = list(_pending_courses)
+                _courses_by_code = {}
+                for course in _pending_courses:
+                    _courses_by_code.setdefault(course['code'], course)
+                _courses_mtime = 0
+                _catalog_version += 1
+            return list(_courses_cache), _catalog_version
+    with _courses_lock:
+        if _courses_cache is not None and mtime == _courses_mtime:
+            return list(_courses_cache), _catalog_version # Return a copy so callers can't mutate the cache
+        seen_version = _catalog_version
+    # Parse outside the lock so concurrent requests aren't serialized behind a slow read
+    loads = orjson.loads if orjson else json.loads
+    with open(COURSE_FILE, 'rb') as file:
+        courses = [loads(line) for line in file if line.strip()] # Parse one course per line
+    # Built in reverse so the first course with a given code wins, as with a linear scan
+    courses_by_code = {course['code']: course for course in reversed(courses)}
+    with _courses_lock:
+        if _catalog_version != seen_version or _appends_in_flight:
+            # Another thread refreshed or extended the cache during the parse, or an append may have
+            # landed in the file while its course is still pending, so keep the current copy
+            return list(_courses_cache), _catalog_version
+        # Keeping queued courses that haven't reached the file yet
+        for course in _pending_courses:
+            courses.append(course)
+            courses_by_code.setdefault(course['code'], course)
+        _courses_cache = courses
+        _courses_mtime = mtime
+        _courses_by_code = courses_by_code
+        _catalog_version += 1
+        return list(courses), _catalog_version
+
+def _append_course(path, payload, course) -> None:
+    """Append one queued course to the file and mark it as no longer pending."""
+    global _courses_mtime, _catalog_version, _appends_in_flight
+    with _courses_lock:
+        _appends_in_flight += 1 # Parses can't be installed until the course leaves the pending list
+    after = None
+    try:
+        # Disk I/O happens outside the cache lock so reads and saves aren't blocked behind it
+        before = os.stat(path).st_mtime if os.path.exists(path) else 0
+        # Append only the new course instead of rewriting the whole catalog
+        with open(path, 'ab') as file:
+            file.write(payload)
+        after = os.stat(path).st_mtime
+    finally:
+        with _courses_lock:
+            _appends_in_flight -= 1
+            _pending_courses.remove(course)
+            # A parse that started before this append must not install a copy missing the course
+            _catalog_version += 1
+            if after is not None and before == _courses_mtime:
+                # The cache matched the file plus pending courses, so it still does after this append
+                _courses_mtime = after
+
+def _course_writer() -> None:
+    """Append queued course data to disk in the background."""
+    while True:
+        path, payload, course = _write_queue.get()
+        try:
+            _append_course(path, payload, course)
+        except Exception as e:
+            # Logging the error message and incrementing the error count
+            error_count = next(error_counter)
+            app.logger.error(f"Error saving course data: {str(e)}")
+            with tracer.start_as_current_span("save_courses_error", kind=SpanKind.INTERNAL) as span:
+                # Adding error attributes to the span (error type, error count) and logging the error message
+                span.set_attribute("error.type", "FileWriteError")
+                span.set_attribute("error.count", error_count)
+                span.add_event(f"Error saving course data: {str(e)}")
+        finally:
+            _write_queue.task_done()
+
+threading.Thread(target=_course_writer, daemon=True).start()
+atexit.register(_write_queue.join) # Flush pending writes on shutdown
+
+def save_courses(data: dict) -> None:
+    """Add new course data to the cache and queue it for appending to the JSON Lines file."""
     required_fields = ['code', 'name']
     missing_fields = [field for field in required_fields if field not in data or not data[field]] # Check for missing fields
-    global error_count # Accessing the global error count variable
+    global _courses_cache, _catalog_version # Accessing the global cache variables
 
-    courses = load_courses()  # Load existing courses
-    if not missing_fields:
-        courses.append(data)  # Append the new course if it doesn't already exist
-    try:
-        # Save the updated course list to the file
-        with open(COURSE_FILE, 'w') as file:
-            json.dump(courses, file, indent=6)
-        app.logger.info(f"Course '{data['name']}' added with code '{data['code']}'") # Logging the success message
-    except Exception as e:
-        # Logging the error message and incrementing the error count
-        error_count+=1
-        app.logger.error(f"Error saving course data: {str(e)}")
-        with tracer.start_as_current_span("save_courses_error", kind=SpanKind.INTERNAL) as span:
-            # Adding error attributes to the span (error type, error count) and logging the error message
-            span.set_attribute("error.type", "FileWriteError")
-            span.set_attribute("error.count", error_count)
-            span.add_event(f"Error saving course data: {str(e)}")
     if missing_fields:
         # Logging the error message and incrementing the error count
         error_message = f"Missing required fields: {', '.join(missing_fields)}"
         app.logger.error(error_message)
         flash(error_message, "error")
 
-        error_count+=1
+        error_count = next(error_counter)
         with tracer.start_as_current_span("save_courses_error", kind=SpanKind.INTERNAL) as span:
             # Adding error attributes to the span
             span.set_attribute("error.type", "MissingFields")
             span.set_attribute("error.count", error_count) 
             span.add_event(error_message)
-        return  # Exit the function if there are missing fields
+        return  # Exit the function before touching the catalog if there are missing fields
+
+    try:
+        line = orjson.dumps(data) if orjson else json.dumps(data).encode() # Serialize in memory and write once
+        load_courses() # Make sure the cache reflects the file before extending it
+        with _courses_lock:
+            # Update the cache right away so the course is visible before it reaches disk
+            _courses_cache = (_courses_cache or []) + [data]
+            _courses_by_code.setdefault(data['code'], data)
+            _catalog_version += 1 # Invalidating the pre-rendered catalog page
+            _pending_courses.append(data)
+            _write_queue.put((COURSE_FILE, line + b'\n', data))
+        app.logger.info(f"Course '{data['name']}' added with code '{data['code']}'") # Logging the success message
+    except Exception as e:
+        # Logging the error message and incrementing the error count
+        error_count = next(error_counter)
+        app.logger.error(f"Error saving course data: {str(e)}")
+        with tracer.start_as_current_span("save_courses_error", kind=SpanKind.INTERNAL) as span:
+            # Adding error attributes to the span (error type, error count) and logging the error message
+            span.set_attribute("error.type", "SerializationError")
+            span.set_attribute("error.count", error_count)
+            span.add_event(f"Error saving course data: {str(e)}")
     flash(f"Course '{data['name']}' added successfully!", "success")
 
+@lru_cache(maxsize=1024)
+def _render_course_details(course_items):
+    """Render the details page for a course, memoized on the course's (field, value) pairs.
+
+    The page depends only on its argument, so a course whose fields change gets a new cache entry.
+    """
+    return render_template('course_details.html', course=dict(course_items))
+
+def traced(name):
+    """Run the decorated route inside a server span with the given name."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name, kind=SpanKind.SERVER):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
 # Routes
+# HTTP method, URL and client IP are recorded by FlaskInstrumentor, so routes only add custom attributes
 @app.route('/') # Home route 
+@traced("index")
 def index():
     user_ip = request.remote_addr  # Getting the user's IP address
-    if (user_ip not in logged_ips): # Logging the user's IP address if not already logged
+    with _logged_ips_lock:
+        is_new_ip = user_ip not in logged_ips
+        logged_ips[user_ip] = None
+        logged_ips.move_to_end(user_ip) # Marking the IP as most recently seen
+        if len(logged_ips) > MAX_LOGGED_IPS:
+            logged_ips.popitem(last=False) # Evicting the least recently seen IP
+    if is_new_ip: # Logging the user's IP address if not already logged
         app.logger.info(f"User IP: {user_ip}")
-        logged_ips.add(user_ip)
-    with tracer.start_as_current_span("index", kind=SpanKind.SERVER) as span: # Starting a span for the index route
-        span.set_attribute("http.client_ip", user_ip)
-        return render_template('index.html')
+    return render_template('index.html')
 
 @app.route('/catalog') # Course catalog route
+@traced("course_catalog")
 def course_catalog():
-    global catalog_access_count
-    catalog_access_count += 1 # Incrementing the catalog access count
-
-    with tracer.start_as_current_span("course_catalog", kind=SpanKind.SERVER) as span:
-        # Setting span attributes (HTTP method, URL) and adding events
-        span.set_attribute("http.method", request.method)
-        span.set_attribute("http.url", request.url)
-        
-        span.set_attribute("catalog.access_count", catalog_access_count)
-        span.add_event("Loading courses from file")
-        courses = load_courses()
-        span.set_attribute("course.count", len(courses))
+    global _rendered_catalog
+    catalog_access_count = next(catalog_access_counter) # Incrementing the catalog access count
+
+    span = trace.get_current_span()
+    span.set_attribute("catalog.access_count", catalog_access_count)
+    span.add_event("Loading courses from file")
+    courses, version = load_catalog()
+    span.set_attribute("course.count", len(courses))
+    page, rendered_version = _rendered_catalog
+    if session.get('_flashes'):
+        # Pending flash messages are part of the page, so it can't be served from or stored in the cache
         span.add_event("Rendering course catalog template")
-        app.logger.info("Course catalog page rendered successfully")
-        return render_template('course_catalog.html', courses=courses)
+        page = render_template('course_catalog.html', courses=courses)
+    elif rendered_version != version:
+        span.add_event("Rendering course catalog template")
+        page = render_template('course_catalog.html', courses=courses)
+        _rendered_catalog = (page, version)
+    else:
+        span.add_event("Serving pre-rendered course catalog")
+    app.logger.info("Course catalog page rendered successfully")
+    return page
 
 @app.route('/add_course', methods=['GET', 'POST']) # Add course route
 def add_course():
     if request.method == 'POST':
+        # Only form submissions are traced, so the span is started here rather than with @traced
         with tracer.start_as_current_span("add_course", kind=SpanKind.SERVER) as span:
-            # Setting span attributes (HTTP method, URL, client IP) and adding events
-            span.set_attribute("http.method", request.method)
-            span.set_attribute("http.url", request.url)
-            span.set_attribute("http.client_ip", request.remote_addr)
             span.add_event("Extracting course data from form")
             # Course data format
-            course = {
-                'code': request.form['code'],
-                'name': request.form['name'],
-                'instructor': request.form['instructor'],
-                'semester': request.form['semester'],
-                'schedule': request.form['schedule'],
-                'classroom': request.form['classroom'],
-                'prerequisites': request.form['prerequisites'],
-                'grading': request.form['grading'],
-                'description': request.form['description']
-            }
-            span.set_attribute("course.code", course['code'])
-            span.set_attribute("course.name", course['name'])
+            form = request.form
+            course = {field: form.get(field, '') for field in COURSE_FIELDS}
+            if span.is_recording():
+                span.set_attribute("course.code", course['code'])
+                span.set_attribute("course.name", course['name'])
             span.add_event("Saving course data to file")
             save_courses(course)
             
@@ -159,34 +320,30 @@ def add_course():
     return render_template('add_course.html')
 
 @app.route('/course/<code>') # Course details route
-def course_details(code):
-    with tracer.start_as_current_span("course_details", kind=SpanKind.SERVER) as span:
-        # Setting span attributes (HTTP method, URL, client IP) and adding events
-        span.set_attribute("http.method", request.method)
-        span.set_attribute("http.url", request.url)
-        span.set_attribute("http.client_ip", request.remote_addr)
-        span.add_event("Loading courses from file")
-        courses = load_courses()
-        span.set_attribute("course.count", len(courses))
+@traced("course_details")
+def course_details(code: str):
+    span = trace.get_current_span()
+    recording = span.is_recording() # Skipping high-cardinality attributes for unsampled spans
+    span.add_event("Loading courses from file")
+    courses = load_courses() # Refreshes the code index if the file changed
+    span.set_attribute("course.count", len(courses))
+    if recording:
         span.add_event(f"Searching for course with code {code}")
-        course = next((course for course in courses if course['code'] == code), None)
-        # If course not found, flashing an error message and redirecting to course catalog
-        if not course:
-            flash(f"No course found with code '{code}'.", "error")
-            return redirect(url_for('course_catalog'))
+    course = _courses_by_code.get(code)
+    # If course not found, flashing an error message and redirecting to course catalog
+    if not course:
+        flash(f"No course found with code '{code}'.", "error")
+        return redirect(url_for('course_catalog'))
+    if recording:
         span.set_attribute("course.code", course['code'])
         span.set_attribute("course.name", course['name'])
-        span.add_event("Rendering course details template")
-        return render_template('course_details.html', course=course)
+    span.add_event("Rendering course details template")
+    return _render_course_details(tuple(course.items()))
 
 @app.route("/manual-trace") # Manual trace route
 def manual_trace():
     # Start a span manually for custom tracing
     with tracer.start_as_current_span("manual-span", kind=SpanKind.SERVER) as span:
-        # Setting span attributes (HTTP method, URL, client IP) and adding events
-        span.set_attribute("http.method", request.method)
-        span.set_attribute("http.url", request.url)
-        span.set_attribute("http.client_ip", request.remote_addr)
         span.add_event("Processing request")
         return "Manual trace recorded!", 200
 
@@ -197,4 +354,5 @@ def auto_instrumented():
 
 # Error handler for 404
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server only, run under gunicorn in production (see README)
+    app.run(debug=False)
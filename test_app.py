@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+
+import pytest
+
+import app
+
+
+def _bump_mtime(path):
+    """Move the file's mtime forward so a change is visible regardless of timestamp granularity."""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    """Point the app at a fresh copy of the catalog with empty caches and a writer that is held back."""
+    course_file = tmp_path / 'course_catalog.jsonl'
+    shutil.copy(os.path.join(os.path.dirname(__file__), 'course_catalog.jsonl'), course_file)
+    monkeypatch.setattr(app, 'COURSE_FILE', str(course_file))
+    monkeypatch.setattr(app, '_courses_cache', None)
+    monkeypatch.setattr(app, '_courses_mtime', 0)
+    monkeypatch.setattr(app, '_courses_by_code', {})
+    monkeypatch.setattr(app, '_pending_courses', [])
+    monkeypatch.setattr(app, '_rendered_catalog', (None, -1))
+    # Queued writes stay here until a test applies them with _append_course
+    monkeypatch.setattr(app, '_write_queue', queue.Queue())
+    # Keeping test records out of the repository's app_logs.jsonl
+    monkeypatch.setattr(app.app.logger, 'handlers', [])
+    app._render_course_details.cache_clear()
+    return course_file
+
+
+def _save(course):
+    with app.app.test_request_context('/add_course', method='POST'):
+        app.save_courses(course)
+
+
+def _flush_writes():
+    while not app._write_queue.empty():
+        app._append_course(*app._write_queue.get())
+
+
+def test_pending_course_survives_reload_after_external_append(catalog):
+    courses_on_disk = len(app.load_courses())
+    _save({'code': 'X1', 'name': 'Queued'})
+
+    # Another worker appends while X1 is still queued in this one
+    with open(catalog, 'a') as file:
+        file.write('{"code": "Z1", "name": "External"}\n')
+    _bump_mtime(catalog)
+    assert len(app.load_courses()) == courses_on_disk + 2
+
+    _flush_writes()
+    courses = app.load_courses()
+    with open(catalog) as file:
+        lines = [line for line in file if line.strip()]
+    assert len(lines) == len(courses) == courses_on_disk + 2
+    assert 'X1' in app._courses_by_code
+    assert 'Z1' in app._courses_by_code
+
+
+def test_parse_does_not_overwrite_cache_extended_meanwhile(catalog, monkeypatch):
+    # Simulating a save that lands while another request is parsing the file on a cold cache
+    loads = app.orjson.loads if app.orjson else app.json.loads
+    saved = []
+
+    def slow_loads(line):
+        if not saved:
+            saved.append(True)
+            _save({'code': 'X2', 'name': 'Added during parse'})
+        return loads(line)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app.orjson or app.json, 'loads', slow_loads)
+        app.load_courses()
+
+    assert 'X2' in app._courses_by_code
+    _flush_writes()
+    assert 'X2' in app._courses_by_code
+    assert any(course['code'] == 'X2' for course in app.load_courses())
+
+
+
+def test_append_does_not_hold_cache_lock_during_io(catalog, monkeypatch):
+    _save({'code': 'X3', 'name': 'Written without the lock'})
+    lock_held = []
+
+    def checking_open(*args, **kwargs):
+        lock_held.append(app._courses_lock.locked())
+        return open(*args, **kwargs)
+
+    monkeypatch.setattr(app, 'open', checking_open, raising=False)
+    _flush_writes()
+    assert lock_held == [False]
+
+
+def test_first_course_is_listed_before_the_file_exists(catalog):
+    os.remove(catalog)
+    _save({'code': 'FIRST', 'name': 'First course'})
+
+    client = app.app.test_client()
+    assert b'FIRST' in client.get('/catalog').data
+    assert client.get('/course/FIRST').status_code == 200
+
+    _flush_writes()
+    assert [course['code'] for course in app.load_courses()] == ['FIRST']
+    assert b'FIRST' in client.get('/catalog').data
+
+def test_log_lines_stay_valid_json_for_quoted_input():
+    record = app.app.logger.makeRecord(
+        'app', logging.INFO, __file__, 0, 'Course \'%s\' added', ('a "quoted"\\\nname',), None)
+    line = app.JsonLineFormatter().format(record)
+    assert '\n' not in line
+    assert json.loads(line)['message'] == 'Course \'a "quoted"\\\nname\' added'
+
+
+
+def test_log_lines_include_exception_tracebacks():
+    try:
+        raise OSError("disk full")
+    except OSError:
+        record = app.app.logger.makeRecord(
+            'app', logging.ERROR, __file__, 0, 'Error saving course data', (), sys.exc_info())
+    entry = json.loads(app.JsonLineFormatter().format(record))
+    assert 'OSError: disk full' in entry['exception']
+
+def test_catalog_page_is_invalidated_after_save(catalog):
+    client = app.app.test_client()
+    assert b'CS101' in client.get('/catalog').data
+    page, version = app._rendered_catalog
+    assert page is not None
+
+    _save({'code': 'NEW1', 'name': 'Newly added'})
+    assert app._catalog_version != version
+    assert b'NEW1' in client.get('/catalog').data
+    assert 'NEW1' in app._rendered_catalog[0]
+
+
+
+def test_catalog_page_shows_course_appended_by_another_worker(catalog):
+    client = app.app.test_client()
+    client.get('/catalog')
+    assert b'OTHER1' not in client.get('/catalog').data # Served from the pre-rendered page
+
+    with open(catalog, 'a') as file:
+        file.write('{"code": "OTHER1", "name": "From another worker"}\n')
+    _bump_mtime(catalog)
+    assert b'OTHER1' in client.get('/catalog').data
+
+
+def test_cold_catalog_page_is_stored_under_current_version(catalog):
+    client = app.app.test_client()
+    page = client.get('/catalog').data.decode()
+    # The first render is reused by the next request instead of being stored under a stale version
+    assert app._rendered_catalog == (page, app._catalog_version)
+
+def test_catalog_page_with_flashes_is_not_stored(catalog):
+    client = app.app.test_client()
+    response = client.post('/add_course', data={'code': '', 'name': 'No code'}, follow_redirects=True)
+    assert b'Missing required fields: code' in response.data
+    assert app._rendered_catalog == (None, -1)
+
+    # The next page is cached and no longer carries the consumed message
+    response = client.get('/catalog')
+    assert b'Missing required fields' not in response.data
+    assert 'Missing required fields' not in app._rendered_catalog[0]
+
+
+def test_course_details_page_is_memoized(catalog):
+    app.load_courses()
+    client = app.app.test_client()
+    assert b'CS101' in client.get('/course/CS101').data
+    assert b'CS101' in client.get('/course/CS101').data
+    assert app._render_course_details.cache_info().hits == 1
+
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Pending message')]
+    response = client.get('/course/CS101')
+    assert app._render_course_details.cache_info().hits == 2
+    assert 'Cookie' not in response.headers.get('Vary', '')
+
+
+def test_catalog_render_does_not_break_trace_context(catalog, caplog):
+    client = app.app.test_client()
+    with caplog.at_level(logging.ERROR, logger='opentelemetry.context'):
+        assert b'CS101' in client.get('/catalog').data
+    assert 'Failed to detach context' not in caplog.text
+
+
+
+def test_course_details_page_follows_changed_course(catalog):
+    client = app.app.test_client()
+    assert b'Introduction to Computer Science' in client.get('/course/CS101').data
+
+    with open(catalog) as file:
+        contents = file.read()
+    with open(catalog, 'w') as file:
+        file.write(contents.replace('Introduction to Computer Science', 'Renamed Course'))
+    _bump_mtime(catalog)
+    response = client.get('/course/CS101')
+    assert b'Renamed Course' in response.data
+    assert b'Introduction to Computer Science' not in response.data
+
+
+def test_course_details_render_depends_only_on_its_argument(catalog):
+    course = {'code': 'ARG1', 'name': 'Passed in'}
+    with app.app.test_request_context('/course/ARG1'):
+        page = app._render_course_details(tuple(course.items()))
+    # Rendered from the argument even though the shared code index doesn't know the course
+    assert 'ARG1' not in app._courses_by_code
+    assert 'Passed in' in page